@@ -1,11 +1,90 @@
-import json
-import re
+from functools import lru_cache
+from io import BytesIO
 from pathlib import Path
+from string import ascii_letters, digits
+from threading import Lock, RLock
 
 import numpy as np
-from PIL import Image, ImageDraw
+import orjson
+from PIL import Image
 
-from hitakort.defaults import CWD, HIT_REGEX
+from hitakort._kernels import normalize, rasterize
+from hitakort.defaults import CWD, MAX_IMAGE_SIZE
+
+# Scratch buffer for the RGB pixel data, shared by all heatmap renders. Pillow copies RGB data when creating
+# the image, so the buffer is only in use while the lock is held.
+_RGB_SCRATCH = np.empty(MAX_IMAGE_SIZE * MAX_IMAGE_SIZE * 3, dtype=np.uint8)
+_RGB_SCRATCH_LOCK = Lock()
+
+
+@lru_cache(maxsize=1024)
+def _index_to_column(index: int) -> str:
+    """Convert a 0-based index to an Excel-style column label.
+
+    Args:
+        index (int): 0-based index to convert.
+
+    Returns:
+        str: Excel-style column label (e.g., 0 -> 'A', 25 -> 'Z', 26 -> 'AA').
+    """
+    result = ""
+    index += 1  # Convert to 1-based index
+    while index > 0:
+        index -= 1
+        result = chr(65 + (index % 26)) + result
+        index = index // 26
+    return result
+
+
+@lru_cache(maxsize=2048)
+def _normalize_point(point: str) -> str:
+    """Normalize the input point to the standard format (e.g., 'a1', 'aaz123').
+
+    Args:
+        point (str): Input point in various formats (e.g., 'A1', '1a', 'AAZ123', '123AAZ').
+
+    Returns:
+        str: Normalized point with letters first (uppercase) followed by numbers.
+
+    Raises:
+        ValueError: If the input point is invalid.
+    """
+    if not point.isascii() or not point.isalnum():
+        raise ValueError(f"Invalid point format: {point}")
+
+    # Split at the first character that does not belong to the leading run of letters or digits
+    if point[0].isalpha():
+        numbers = point.lstrip(ascii_letters)
+        letters = point[: len(point) - len(numbers)]
+    else:
+        letters = point.lstrip(digits)
+        numbers = point[: len(point) - len(letters)]
+
+    if not letters.isalpha() or not numbers.isdigit():
+        raise ValueError(f"Invalid point format: {point}")
+
+    return letters.upper() + numbers
+
+
+def _ascii_color(intensity: int) -> str:
+    """Get the ANSI color code closest to the heatmap colour of the given intensity.
+
+    Args:
+        intensity (int): Intensity of the cell from 0 (no hits) to 255 (most hits).
+
+    Returns:
+        str: ANSI color code.
+    """
+    r, g, b = 255, 255 - intensity, 255 - intensity  # White to Red gradient
+
+    # Convert RGB to the closest ANSI 256-color code
+    ansi_code = 16 + (36 * round(r / 255 * 5)) + (6 * round(g / 255 * 5)) + round(b / 255 * 5)
+    return f"\033[38;5;{ansi_code}m"
+
+
+# Coloured ASCII heatmap cells (Unicode full blocks) for every possible intensity
+_ASCII_CELLS = [f"{_ascii_color(intensity)}██\033[0m" for intensity in range(256)]
+_ASCII_EMPTY_CELL = "\033[38;5;255m██\033[0m"  # White for no hits
 
 
 class HitaKort:
@@ -15,81 +94,202 @@ class HitaKort:
     both data and image representations of the heatmap.
 
     Args:
-        file_path (Path): Path to the JSON file for storing hit data.
-            Can be a directory or a file path.
-            Defaults to "./heatmap_data.json" in the current directory.
+        file_path (Path): Path to the NumPy ``.npy`` file for storing hit data.
+            Can be a directory or a file path. Legacy ``.json`` files next to it are migrated on load.
+            Defaults to "./heatmap_data.npy" in the current directory.
         grid_size (int): Size of the grid (6x6). Defaults to 6.
         override_size (bool): Whether to override the grid size if the persisted data size is different.
             Defaults to True.
+        flush_threshold (int): Number of unsaved hits after which the data is written to disk. Defaults to 16.
+        create (bool): Whether to create a new empty grid if no hit data has been persisted yet.
+            Defaults to True.
+
+    Raises:
+        FileNotFoundError: If ``create`` is False and no hit data has been persisted.
 
     Attributes:
-        grid (dict[str, int]): Dictionary to store hit counts for each grid point.
+        grid (dict[str, int]): Hit counts for each grid point, built from the underlying array.
         size (int): Size of the grid.
-        file_path (Path): Path to the JSON file for storing hit data.
+        file_path (Path): Path to the NumPy ``.npy`` file for storing hit data.
     """
 
-    def __init__(self, file_path: Path = CWD, grid_size: int = 6, override_size: bool = True) -> None:
+    def __init__(
+        self,
+        file_path: Path = CWD,
+        grid_size: int = 6,
+        override_size: bool = True,
+        flush_threshold: int = 16,
+        create: bool = True,
+    ) -> None:
         if not file_path.suffix:
-            file_path = file_path / "heatmap_data.json"
+            file_path = file_path / "heatmap_data.npy"
+        file_path = file_path.with_suffix(".npy")
 
         file_path.parent.mkdir(parents=True, exist_ok=True)
-        if not file_path.exists():
-            file_path.write_text("{}")
 
-        self.grid: dict[str, int] = {}
         self.size: int = grid_size
         self.file_path: Path = file_path
+        self._grid: np.ndarray = np.zeros((self.size, self.size), dtype=np.int32)
+        self._max_value = 0
+        self._col_labels: list[str] = []
+        self._point_index: dict[str, tuple[int, int]] = {}
+        self._flush_threshold = flush_threshold
+        self._dirty = False
+        self._hits_since_flush = 0
+        self._deleted = False
+        self._closed = False
+        self._png_cache: bytes | None = None
+        self._lock = RLock()  # Hits, saves and renders may run in worker threads
         self._initialize_grid()
-        self._load_data(override_size=override_size)
+        self._load_data(override_size=override_size, create=create)
 
     def _initialize_grid(self) -> None:
-        """Initialize the grid with zero hits for all points."""
-        for row in range(1, self.size + 1):
-            for col in range(self.size):
-                point = f"{self._index_to_column(col)}{row}"
-                self.grid[point] = 0
+        """Initialize the grid with zero hits for all points and build the column labels and point lookup."""
+        self._grid = np.zeros((self.size, self.size), dtype=np.int32)
+        self._max_value = 0
+        self._col_labels = [self._index_to_column(col) for col in range(self.size)]
+        self._point_index = {
+            f"{label}{row + 1}": (row, col) for row in range(self.size) for col, label in enumerate(self._col_labels)
+        }
+
+    @property
+    def max_value(self) -> int:
+        """int: Highest hit count of all grid points."""
+        return self._max_value
+
+    @property
+    def grid(self) -> dict[str, int]:
+        """dict[str, int]: Hit counts for each grid point (e.g., 'A1')."""
+        return {point: int(self._grid[index]) for point, index in self._point_index.items()}
 
     @staticmethod
     def _index_to_column(index: int) -> str:
-        """Convert a 0-based index to an Excel-style column label.
+        """Convert a 0-based index to an Excel-style column label, see :func:`_index_to_column`."""
+        return _index_to_column(index)
+
+    @staticmethod
+    def data_exists(file_path: Path) -> bool:
+        """Check whether hit data has been persisted for the given file path.
 
         Args:
-            index (int): 0-based index to convert.
+            file_path (Path): Path to the ``.npy`` file, a legacy ``.json`` file next to it is accepted as well.
 
         Returns:
-            str: Excel-style column label (e.g., 0 -> 'A', 25 -> 'Z', 26 -> 'AA').
+            bool: True if hit data exists.
         """
-        result = ""
-        index += 1  # Convert to 1-based index
-        while index > 0:
-            index -= 1
-            result = chr(65 + (index % 26)) + result
-            index = index // 26
-        return result
+        return file_path.with_suffix(".npy").exists() or file_path.with_suffix(".json").exists()
+
+    def _load_data(self, override_size: bool, create: bool) -> None:
+        """Load hit data from the file if it exists, otherwise create it.
 
-    def _load_data(self, override_size: bool) -> None:
-        """Load hit data from the JSON file if it exists.
+        Legacy JSON files are migrated to the NumPy format and removed.
 
         Args:
             override_size (bool): Whether to override the grid size if the persisted data size is different
+            create (bool): Whether to create the file if no hit data has been persisted yet
 
         Raises:
             ValueError: If the grid data size does not match the expected size.
+            FileNotFoundError: If ``create`` is False and no hit data has been persisted.
         """
-        if self.file_path.exists() and (grid_data := json.loads(self.file_path.read_text())):
-            if override_size or len(grid_data) == self.size**2:
-                self.grid = grid_data
-                self.size = int(len(grid_data) ** 0.5)
+        legacy_file_path = self.file_path.with_suffix(".json")
+        data: np.ndarray | None = None
+        if self.file_path.exists():
+            data = np.load(self.file_path).astype(np.int32, copy=False)
+        elif legacy_file_path.exists():
+            data = self._load_legacy_data(legacy_file_path)
+        elif not create:
+            raise FileNotFoundError(f"No hit data found at {self.file_path}")
+
+        if data is not None:
+            if override_size or data.shape == (self.size, self.size):
+                if data.shape[0] != self.size:
+                    self.size = data.shape[0]
+                    self._initialize_grid()
+                self._grid = data
+                self._max_value = int(data.max()) if data.size else 0
             else:
                 raise ValueError("Persisted grid data size does not match the expected size")
 
+        if not self.file_path.exists():
+            self._save_data()
+            legacy_file_path.unlink(missing_ok=True)
+
+    @classmethod
+    def _load_legacy_data(cls, file_path: Path) -> np.ndarray | None:
+        """Load hit data from a legacy JSON file.
+
+        Args:
+            file_path (Path): Path to the JSON file.
+
+        Returns:
+            np.ndarray | None: 2D array of hit counts or None if the file holds no data.
+        """
+        if not (grid_data := orjson.loads(file_path.read_bytes())):
+            return None
+        if "data" in grid_data:
+            return np.asarray(grid_data["data"], dtype=np.int32)
+        return cls._legacy_grid_to_array(grid_data)
+
+    @classmethod
+    def _legacy_grid_to_array(cls, grid_data: dict[str, int]) -> np.ndarray:
+        """Convert the legacy point to hits mapping (e.g., {'A1': 0, ...}) to a 2D array.
+
+        Args:
+            grid_data (dict[str, int]): Hit counts keyed by grid point.
+
+        Returns:
+            np.ndarray: 2D array of hit counts.
+        """
+        size = int(len(grid_data) ** 0.5)
+        col_labels = [cls._index_to_column(col) for col in range(size)]
+        data = np.zeros((size, size), dtype=np.int32)
+        for row in range(size):
+            for col, label in enumerate(col_labels):
+                data[row, col] = grid_data.get(f"{label}{row + 1}", 0)
+        return data
+
     def _save_data(self) -> None:
-        """Save hit data to the JSON file."""
-        self.file_path.write_text(json.dumps(self.grid))
+        """Save hit data to the NumPy file, unless the data has been deleted."""
+        if self._deleted:
+            return
+        np.save(self.file_path, self._grid)
+        self._dirty = False
+        self._hits_since_flush = 0
+
+    def flush(self) -> None:
+        """Save hit data to the NumPy file if there are unsaved hits."""
+        with self._lock:
+            if self._dirty:
+                self._save_data()
+
+    def close(self) -> None:
+        """Save unsaved hits and write any later hits to disk immediately until :meth:`reopen` is called."""
+        with self._lock:
+            self._closed = True
+            self.flush()
+
+    def reopen(self) -> None:
+        """Go back to batching hit writes after :meth:`close`."""
+        with self._lock:
+            self._closed = False
+
+    def delete(self) -> None:
+        """Delete the persisted hit data and discard any unsaved hits.
+
+        Hits recorded after deletion, e.g. by a hit that was already in progress, are ignored and never saved.
+        """
+        with self._lock:
+            self._deleted = True
+            self._dirty = False
+            self._hits_since_flush = 0
+            self.file_path.unlink(missing_ok=True)
 
     def input_hit(self, point: str) -> None:
         """Record a hit for the given grid point.
 
+        The hit is persisted once the flush threshold is reached or when :meth:`flush` is called.
+
         Args:
             point (str): Grid point in various formats (e.g., 'a1', 'A1', '1a', '1A', 'AAZ123', '123AAZ').
 
@@ -97,44 +297,41 @@ class HitaKort:
             ValueError: If the input point is invalid or out of the grid's range.
         """
         normalized_point = self._normalize_point(point)
-        if normalized_point not in self.grid:
-            raise ValueError(f"Point out of range: {point}")
-        self.grid[normalized_point] += 1
-        self._save_data()
+        try:
+            row, col = self._point_index[normalized_point]
+        except KeyError:
+            raise ValueError(f"Point out of range: {point}") from None
+
+        with self._lock:
+            if self._deleted:
+                return
+            self._grid[row, col] += 1
+            self._max_value = max(self._max_value, int(self._grid[row, col]))
+            self._png_cache = None
+            self._dirty = True
+            self._hits_since_flush += 1
+            if self._closed or self._hits_since_flush >= self._flush_threshold:
+                self._save_data()
 
     def _normalize_point(self, point: str) -> str:
-        """Normalize the input point to the standard format (e.g., 'a1', 'aaz123').
+        """Normalize the input point to the standard format, see :func:`_normalize_point`."""
+        return _normalize_point(point)
 
-        Args:
-            point (str): Input point in various formats (e.g., 'A1', '1a', 'AAZ123', '123AAZ').
+    def generate_heatmap_data(self) -> list[list[int]]:
+        """Generate a 2D list representing the heatmap data.
 
         Returns:
-            str: Normalized point with letters first (uppercase) followed by numbers.
-
-        Raises:
-            ValueError: If the input point is invalid.
+            list[list[int]]: 2D list of hit counts.
         """
-        match = re.match(HIT_REGEX, point)
-
-        if not match:
-            raise ValueError(f"Invalid point format: {point}")
+        return self._grid.tolist()  # type: ignore[no-any-return]
 
-        groups = match.groupdict()
-        if groups["letters"]:
-            return f"{groups['letters'].upper()}{groups['numbers']}"
-        else:
-            return f"{groups['letters_second'].upper()}{groups['numbers_first']}"
-
-    def generate_heatmap_data(self) -> list[list[int]]:
-        """Generate a 2D list representing the heatmap data.
+    def _intensity(self) -> np.ndarray:
+        """Normalize the hit counts to intensities relative to the most hit cell.
 
         Returns:
-            list[list[int]]: 2D list of hit counts.
+            np.ndarray: 2D uint8 array with 0 for no hits up to 255 for the most hit cell.
         """
-        return [
-            [self.grid[f"{self._index_to_column(col)}{row + 1}"] for col in range(self.size)]
-            for row in range(self.size)
-        ]
+        return normalize(self._grid, self._max_value)
 
     def generate_heatmap_image(self) -> Image.Image:
         """Generate a heatmap image.
@@ -142,63 +339,34 @@ class HitaKort:
         Returns:
             Image.Image: A Pillow Image object representing the heatmap.
         """
-        heatmap_data = np.array(self.generate_heatmap_data())
-        max_value = np.max(heatmap_data)
-
         # Calculate the largest multiple of grid size that fits within 1024x1024
-        img_size = min(1024, self.size * (1024 // self.size))
-
-        # Resize the heatmap data to the calculated size
-        resized_data = heatmap_data.repeat(img_size // self.size, axis=0).repeat(img_size // self.size, axis=1)
-
-        # Normalize the data and convert to RGB
-        normalized_data = resized_data / max_value if max_value > 0 else resized_data
-        rgb_data = np.zeros((img_size, img_size, 3), dtype=np.uint8)
-        rgb_data[..., 0] = 255  # Red channel
-        rgb_data[..., 1] = rgb_data[..., 2] = 255 - (normalized_data * 255).astype(np.uint8)
+        img_size = min(MAX_IMAGE_SIZE, self.size * (MAX_IMAGE_SIZE // self.size))
+        step = img_size // self.size
 
-        # Create image from the array
-        img = Image.fromarray(rgb_data)
+        with self._lock, _RGB_SCRATCH_LOCK:
+            # Contiguous view on the front of the scratch buffer. Pillow copies RGB data into the image, so the
+            # shared buffer is only needed while the lock is held
+            rgb_data = _RGB_SCRATCH[: img_size * img_size * 3].reshape(img_size, img_size, 3)
+            rasterize(self._grid, rgb_data, step, self._max_value)
 
-        # Add grid lines if the size is 1024x1024 or smaller
-        if img_size <= 1024:
-            img_with_grid = self._add_grid_lines(img)
-            return img_with_grid
+            # Create image from the buffer
+            return Image.frombuffer("RGB", (img_size, img_size), rgb_data, "raw", "RGB", 0, 1)
 
-        return img
+    def get_png_bytes(self) -> bytes:
+        """Get the heatmap image encoded as PNG.
 
-    def _add_grid_lines(self, img: Image.Image) -> Image.Image:
-        """Add grid lines to the image.
-
-        Args:
-            img (Image.Image): The input image.
-
-        Returns:
-            Image.Image: The image with grid lines added.
-        """
-        draw = ImageDraw.Draw(img)
-        step = img.width // self.size
-        for i in range(1, self.size):
-            line_position = i * step
-            draw.line([(line_position, 0), (line_position, img.height)], fill=(0, 0, 0), width=1)
-            draw.line([(0, line_position), (img.width, line_position)], fill=(0, 0, 0), width=1)
-        return img
-
-    @staticmethod
-    def _get_color(value: int, max_value: int) -> tuple[int, int, int]:
-        """Get the color for a cell based on its value.
-
-        Args:
-            value (int): Hit count for the cell.
-            max_value (int): Maximum hit count in the grid.
+        The encoded image is cached until the next hit is recorded.
 
         Returns:
-            tuple[int, int, int]: RGB color tuple.
+            bytes: The PNG encoded heatmap image.
         """
-        if max_value == 0:
-            return (255, 255, 255)  # White for no hits
-        intensity = int(255 * (value / max_value))
-        return (255, 255 - intensity, 255 - intensity)  # White to Red gradient
+        with self._lock:
+            if self._png_cache is None:
+                buffer = BytesIO()
+                # Flat colour blocks compress well even with the fastest zlib level
+                self.generate_heatmap_image().save(buffer, format="PNG", compress_level=1, optimize=False)
+                self._png_cache = buffer.getvalue()
+            return self._png_cache
 
     def generate_ascii_heatmap(self) -> str:
         """Generate a coloured ASCII art representation of the heatmap.
@@ -206,41 +374,15 @@ class HitaKort:
         Returns:
             str: A string containing the ASCII art heatmap with ANSI color codes.
         """
-        heatmap_data = self.generate_heatmap_data()
-        max_value = max(max(row) for row in heatmap_data)
-
-        ascii_map = []
-        for row in heatmap_data:
-            ascii_row = []
-            for value in row:
-                color_code = self._get_ascii_color(value, max_value)
-                ascii_row.append(f"{color_code}██\033[0m")  # Use Unicode full block
-            ascii_map.append("".join(ascii_row))
+        if self._max_value > 0:
+            ascii_map = ["".join([_ASCII_CELLS[value] for value in row]) for row in self._intensity().tolist()]
+        else:
+            ascii_map = [_ASCII_EMPTY_CELL * self.size] * self.size
 
         # Add column labels
-        col_labels = "   " + "".join(f"{self._index_to_column(i):2}" for i in range(self.size))
+        col_labels = "   " + "".join(f"{label:2}" for label in self._col_labels)
 
         # Add row labels and construct the final map
         labelled_map = [col_labels] + [f"{i + 1:2} " + row for i, row in enumerate(ascii_map)]
 
         return "\n".join(labelled_map)
-
-    @staticmethod
-    def _get_ascii_color(value: int, max_value: int) -> str:
-        """Get the ANSI color code for a cell based on its value.
-
-        Args:
-            value (int): Hit count for the cell.
-            max_value (int): Maximum hit count in the grid.
-
-        Returns:
-            str: ANSI color code.
-        """
-        if max_value == 0:
-            return "\033[38;5;255m"  # White for no hits
-
-        r, g, b = HitaKort._get_color(value, max_value)
-
-        # Convert RGB to the closest ANSI 256-color code
-        ansi_code = 16 + (36 * round(r / 255 * 5)) + (6 * round(g / 255 * 5)) + round(b / 255 * 5)
-        return f"\033[38;5;{ansi_code}m"
@@ -1,7 +1,9 @@
 # SPDX-License-Identifier: LGPL-3.0-or-later
 # Copyright (c) 2024 Nachtalb
+import asyncio
 import logging
-from functools import reduce
+import weakref
+from collections import OrderedDict
 from io import BytesIO
 from pathlib import Path
 
@@ -11,9 +13,84 @@ from telegram.error import BadRequest
 from telegram.ext import Application, CommandHandler, ContextTypes, ExtBot, MessageHandler, filters
 
 from hitakort._hitakort import HitaKort
-from hitakort.defaults import CWD, HIT_REGEX
+from hitakort.defaults import CWD, HIT_REGEX, MAX_IMAGE_SIZE
 from hitakort.utils import sel
 
+_START_TEXT = sel(
+    """<b>HitaKort Bot</b>
+
+    👋 Hello! I'm HitaKort Bot. <i>Hita</i> is Old Norse for <code>heat</code> and <i>Kort</i> is Old Norse for <code>Map</code>. Giving me hits on a 6x6 grid I will return a heatmap where the hits are located most frequently.
+
+    🎉 First send me the grid size you want with /size &lt;num&gt;. Then send me a hit in the format of ROW COLUMN where ROW is a letter and COLUMN is a number. For example: A1, B2, C3, etc.
+    """
+)
+_SIZE_ALREADY_SET_TEXT = sel(
+    """<b>Grid Size Already Set</b>
+
+    🤔 You have already set the grid size. If you want to reset the heatmap, use /reset.
+    """
+)
+_SIZE_MISSING_TEXT = sel(
+    """<b>Set Grid Size</b>
+
+    🤔 You need to specify the grid size with /size &lt;num&gt;. For example: /size 6.
+    """
+)
+_SIZE_INVALID_TEXT = sel(
+    """<b>Invalid Grid Size</b>
+
+    🤔 The grid size must be an integer between 2 and {max_size}.
+    """
+)
+_SIZE_FAILED_TEXT = sel(
+    """<b>Failed to set Grid Size</b>
+
+    🤔 An error occurred while setting the grid size.
+    """
+)
+_SIZE_SET_TEXT = sel(
+    """<b>Grid Size Set</b>
+
+    🎉 The grid size has been set to {size}. You can now start adding hits to the grid.
+    """
+)
+_GRID_RESET_TEXT = sel(
+    """<b>Grid Reset</b>
+
+    🎉 The grid has been reset. You can now set the grid size with /size &lt;num&gt;.
+    """
+)
+_SIZE_NOT_SET_TEXT = sel(
+    """<b>Grid Size Not Set</b>
+
+    🤔 You need to set the grid size first with /size &lt;num&gt;.
+    """
+)
+_HIT_ADDED_TEXT = sel(
+    """<b>Hit Added</b>
+
+    🎉 The hit {hit} has been added to the grid. You can view the heatmap with /image.
+    """
+)
+_HIT_INVALID_TEXT = sel(
+    """<b>Invalid Hit</b>
+
+    🤔 You need to send me a valid hit in the format of ROW COLUMN where ROW is a letter and COLUMN is a number. For example: A1, B2, C3, etc.
+    """
+)
+_WRONG_FORMAT_TEXT = sel(
+    """<b>Wrong format</b>
+
+    🤔 You need to send me a valid hit in the format of ROW COLUMN where ROW is a letter and COLUMN is a number. For example: A1, B2, C3, etc.
+    """
+)
+_NOT_SUPPORTED_TEXT = sel(
+    """<b>Not supported</b>
+
+    🤔 I'm sorry, but I don't support this type of message.
+    """
+)
+
 
 class HitaKortBot:
     def __init__(
@@ -22,6 +99,7 @@ class HitaKortBot:
         lock_to_admins: bool = True,
         local_mode: bool = False,
         hitakort_path: Path = CWD,
+        max_loaded_hitakorts: int = 128,
     ):
         self.logger = logging.getLogger(__name__)
         self.local_mode = local_mode
@@ -30,19 +108,58 @@ class HitaKortBot:
 
         self.bot: ExtBot = None  # type: ignore[type-arg, assignment]
         self.hitakort_path = hitakort_path / "users"
-        self.hitakorts: dict[int, HitaKort] = {}
+        # Most recently used heatmaps, the rest only live on disk
+        self.hitakorts: OrderedDict[int, HitaKort] = OrderedDict()
+        self.max_loaded_hitakorts = max_loaded_hitakorts
+        # Evicted heatmaps that are still referenced by unfinished updates
+        self._evicted_hitakorts: weakref.WeakValueDictionary[int, HitaKort] = weakref.WeakValueDictionary()
+        # Serialises loading, creating and resetting a user's heatmap
+        self._user_locks: weakref.WeakValueDictionary[int, asyncio.Lock] = weakref.WeakValueDictionary()
+
+    def _user_lock(self, user_id: int) -> asyncio.Lock:
+        if (lock := self._user_locks.get(user_id)) is None:
+            lock = self._user_locks[user_id] = asyncio.Lock()
+        return lock
+
+    async def _get_hitakort(self, user_id: int) -> HitaKort | None:
+        async with self._user_lock(user_id):
+            return await self._get_hitakort_unlocked(user_id)
+
+    async def _get_hitakort_unlocked(self, user_id: int) -> HitaKort | None:
+        if user_id in self.hitakorts:
+            self.hitakorts.move_to_end(user_id)
+            return self.hitakorts[user_id]
+
+        if (hitakort := self._evicted_hitakorts.pop(user_id, None)) is not None:
+            # Reloading from disk could miss hits the evicted instance has yet to write, so reuse it instead
+            await self._add_hitakort(user_id, hitakort)
+            if self.hitakorts.get(user_id) is hitakort:
+                await asyncio.to_thread(hitakort.reopen)
+            return hitakort
+
+        try:
+            hitakort = await asyncio.to_thread(HitaKort, self._hitakort_file(user_id), create=False)
+        except FileNotFoundError:
+            return None
+        return await self._add_hitakort(user_id, hitakort)
+
+    async def _add_hitakort(self, user_id: int, hitakort: HitaKort) -> HitaKort:
+        self.hitakorts[user_id] = hitakort
+        while len(self.hitakorts) > self.max_loaded_hitakorts:
+            evicted_user_id, evicted = self.hitakorts.popitem(last=False)
+            self._evicted_hitakorts[evicted_user_id] = evicted
+            await asyncio.to_thread(evicted.close)
+        return hitakort
+
+    def _hitakort_file(self, user_id: int) -> Path:
+        return self.hitakort_path / (str(user_id) + ".npy")
 
     def setup_hooks(self, application: Application) -> None:  # type: ignore[type-arg]
         hit_filter = filters.Regex(HIT_REGEX)
         admin_filter = None
 
         if self.lock_to_admins and self.admins:
-            user_filters = [filters.User(user) for user in self.admins]
-            multi_user_filter = user_filters[0]
-            if len(user_filters) > 1:
-                multi_user_filter = reduce(lambda x, y: x | y, user_filters)  # type: ignore[arg-type, return-value]
-
-            admin_filter = filters.ChatType.PRIVATE & multi_user_filter
+            admin_filter = filters.ChatType.PRIVATE & filters.User(self.admins)
 
         application.add_handler(CommandHandler("start", self.start, filters=admin_filter, block=False))
         application.add_handler(CommandHandler("size", self.size, filters=admin_filter, block=False))
@@ -66,14 +183,7 @@ class HitaKortBot:
 
         self.logger.info(f"Received start command from: {update.effective_user.full_name}")
 
-        text = """<b>HitaKort Bot</b>
-
-        👋 Hello! I'm HitaKort Bot. <i>Hita</i> is Old Norse for <code>heat</code> and <i>Kort</i> is Old Norse for <code>Map</code>. Giving me hits on a 6x6 grid I will return a heatmap where the hits are located most frequently.
-
-        🎉 First send me the grid size you want with /size &lt;num&gt;. Then send me a hit in the format of ROW COLUMN where ROW is a letter and COLUMN is a number. For example: A1, B2, C3, etc.
-        """
-
-        await update.message.reply_text(sel(text), parse_mode=ParseMode.HTML)
+        await update.message.reply_text(_START_TEXT, parse_mode=ParseMode.HTML)
 
     async def size(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         if not update.message or not update.effective_user:
@@ -82,49 +192,33 @@ class HitaKortBot:
         self.logger.info(f"Received size command from: {update.effective_user.full_name}")
 
         user_id = update.effective_user.id
-        if user_id in self.hitakorts:
-            text = """<b>Grid Size Already Set</b>
-
-            🤔 You have already set the grid size. If you want to reset the heatmap, use /reset.
-            """
-            await update.message.reply_text(sel(text), parse_mode=ParseMode.HTML)
-            return
-
-        if not context.args:
-            text = """<b>Set Grid Size</b>
-
-            🤔 You need to specify the grid size with /size &lt;num&gt;. For example: /size 6.
-            """
-            await update.message.reply_text(sel(text), parse_mode=ParseMode.HTML)
-            return
-
-        try:
-            size = int(context.args[0])
-            if size < 2:
-                raise ValueError
-        except ValueError:
-            text = """<b>Invalid Grid Size</b>
-
-            🤔 The grid size must be an integer greater than 1.
-            """
-            await update.message.reply_text(sel(text), parse_mode=ParseMode.HTML)
-            return
-        except Exception as e:
-            self.logger.error(f"Failed to parse grid size: {e}")
-            text = """<b>Failed to set Grid Size</b>
+        async with self._user_lock(user_id):
+            if await self._get_hitakort_unlocked(user_id) is not None:
+                await update.message.reply_text(_SIZE_ALREADY_SET_TEXT, parse_mode=ParseMode.HTML)
+                return
 
-            🤔 An error occurred while setting the grid size.
-            """
-            await update.message.reply_text(sel(text), parse_mode=ParseMode.HTML)
-            return
-
-        self.hitakorts[user_id] = HitaKort(self.hitakort_path / (str(user_id) + ".json"), size)
-
-        text = f"""<b>Grid Size Set</b>
+            if not context.args:
+                await update.message.reply_text(_SIZE_MISSING_TEXT, parse_mode=ParseMode.HTML)
+                return
 
-        🎉 The grid size has been set to {size}. You can now start adding hits to the grid.
-        """
-        await update.message.reply_text(sel(text), parse_mode=ParseMode.HTML)
+            try:
+                size = int(context.args[0])
+                if not 2 <= size <= MAX_IMAGE_SIZE:
+                    raise ValueError
+            except ValueError:
+                await update.message.reply_text(
+                    _SIZE_INVALID_TEXT.format(max_size=MAX_IMAGE_SIZE), parse_mode=ParseMode.HTML
+                )
+                return
+            except Exception as e:
+                self.logger.error(f"Failed to parse grid size: {e}")
+                await update.message.reply_text(_SIZE_FAILED_TEXT, parse_mode=ParseMode.HTML)
+                return
+
+            hitakort = await asyncio.to_thread(HitaKort, self._hitakort_file(user_id), size)
+            await self._add_hitakort(user_id, hitakort)
+
+        await update.message.reply_text(_SIZE_SET_TEXT.format(size=size), parse_mode=ParseMode.HTML)
 
     async def heatmap(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         if not update.message or not update.effective_user:
@@ -133,21 +227,12 @@ class HitaKortBot:
         self.logger.info(f"Received heatmap command from: {update.effective_user.full_name}")
 
         user_id = update.effective_user.id
-        if user_id not in self.hitakorts:
-            text = """<b>Grid Size Not Set</b>
-
-            🤔 You need to set the grid size first with /size &lt;num&gt;.
-            """
-            await update.message.reply_text(sel(text), parse_mode=ParseMode.HTML)
+        if (hitakort := await self._get_hitakort(user_id)) is None:
+            await update.message.reply_text(_SIZE_NOT_SET_TEXT, parse_mode=ParseMode.HTML)
             return
 
-        hitakort = self.hitakorts[user_id]
-        image = hitakort.generate_heatmap_image()
-
-        bytes = BytesIO()
-        image.save(bytes, format="PNG")
-        bytes.seek(0)
-        await update.message.reply_photo(bytes, filename="heatmap.png")
+        png_bytes = await asyncio.to_thread(hitakort.get_png_bytes)
+        await update.message.reply_photo(BytesIO(png_bytes), filename="heatmap.png")
 
     async def reset(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         if not update.message or not update.effective_user:
@@ -156,22 +241,15 @@ class HitaKortBot:
         self.logger.info(f"Received reset command from: {update.effective_user.full_name}")
 
         user_id = update.effective_user.id
-        if user_id not in self.hitakorts:
-            text = """<b>Grid Size Not Set</b>
-
-            🤔 You need to set the grid size first with /size &lt;num&gt;.
-            """
-            await update.message.reply_text(sel(text), parse_mode=ParseMode.HTML)
-            return
+        async with self._user_lock(user_id):
+            if (hitakort := await self._get_hitakort_unlocked(user_id)) is None:
+                await update.message.reply_text(_SIZE_NOT_SET_TEXT, parse_mode=ParseMode.HTML)
+                return
 
-        self.hitakorts[user_id].file_path.unlink(missing_ok=True)
-        del self.hitakorts[user_id]
+            self.hitakorts.pop(user_id, None)
+            await asyncio.to_thread(hitakort.delete)
 
-        text = """<b>Grid Reset</b>
-
-        🎉 The grid has been reset. You can now set the grid size with /size &lt;num&gt;.
-        """
-        await update.message.reply_text(sel(text), parse_mode=ParseMode.HTML)
+        await update.message.reply_text(_GRID_RESET_TEXT, parse_mode=ParseMode.HTML)
 
     async def add_hit(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         if not update.message or not update.effective_user or not update.message.text:
@@ -180,31 +258,17 @@ class HitaKortBot:
         self.logger.info(f"Received hit from: {update.effective_user.full_name}")
 
         user_id = update.effective_user.id
-        if user_id not in self.hitakorts:
-            text = """<b>Grid Size Not Set</b>
-
-            🤔 You need to set the grid size first with /size &lt;num&gt;.
-            """
-            await update.message.reply_text(sel(text), parse_mode=ParseMode.HTML)
+        if (hitakort := await self._get_hitakort(user_id)) is None:
+            await update.message.reply_text(_SIZE_NOT_SET_TEXT, parse_mode=ParseMode.HTML)
             return
 
-        hitakort = self.hitakorts[user_id]
         hit = update.message.text.upper()
         try:
-            hitakort.input_hit(hit)
+            await asyncio.to_thread(hitakort.input_hit, hit)
 
-            text = f"""<b>Hit Added</b>
-
-            🎉 The hit {hit} has been added to the grid. You can view the heatmap with /image.
-            """
-
-            await update.message.reply_text(sel(text), parse_mode=ParseMode.HTML)
+            await update.message.reply_text(_HIT_ADDED_TEXT.format(hit=hit), parse_mode=ParseMode.HTML)
         except ValueError:
-            text = """<b>Invalid Hit</b>
-
-            🤔 You need to send me a valid hit in the format of ROW COLUMN where ROW is a letter and COLUMN is a number. For example: A1, B2, C3, etc.
-            """
-            await update.message.reply_text(sel(text), parse_mode=ParseMode.HTML)
+            await update.message.reply_text(_HIT_INVALID_TEXT, parse_mode=ParseMode.HTML)
 
     async def wrong_format(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         if not update.message or not update.effective_user:
@@ -212,12 +276,7 @@ class HitaKortBot:
 
         self.logger.info(f"Received wrong format message from: {update.effective_user.full_name}")
 
-        text = """<b>Wrong format</b>
-
-        🤔 You need to send me a valid hit in the format of ROW COLUMN where ROW is a letter and COLUMN is a number. For example: A1, B2, C3, etc.
-        """
-
-        await update.message.reply_text(sel(text), parse_mode=ParseMode.HTML)
+        await update.message.reply_text(_WRONG_FORMAT_TEXT, parse_mode=ParseMode.HTML)
 
     async def not_supported(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         if not update.message or not update.effective_user:
@@ -225,12 +284,7 @@ class HitaKortBot:
 
         self.logger.info(f"Received not supported message from: {update.effective_user.full_name}")
 
-        text = """<b>Not supported</b>
-
-        🤔 I'm sorry, but I don't support this type of message.
-        """
-
-        await update.message.reply_text(sel(text), parse_mode=ParseMode.HTML)
+        await update.message.reply_text(_NOT_SUPPORTED_TEXT, parse_mode=ParseMode.HTML)
 
     async def post_init(self, app: Application) -> None:  # type: ignore[type-arg]
         self.app = app
@@ -251,11 +305,19 @@ class HitaKortBot:
             except BadRequest as e:
                 self.logger.error(f"Failed to send message to admin: {admin}, error: {e}")
 
-        for file in self.hitakort_path.glob("*.json"):
-            user_id = int(file.stem)
-            self.hitakorts[user_id] = HitaKort(file)
+        if app.job_queue:
+            app.job_queue.run_repeating(self.flush, interval=5)
+
+    async def flush(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        await asyncio.to_thread(self._flush_all)
+
+    def _flush_all(self) -> None:
+        for hitakort in list(self.hitakorts.values()):
+            hitakort.flush()
 
     async def post_stop(self, app: Application) -> None:  # type: ignore[type-arg]
+        self._flush_all()
+
         for admin in self.admins:
             try:
                 await self.bot.send_message(admin, "Bot stopped!")
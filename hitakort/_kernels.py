@@ -0,0 +1,43 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# Copyright (c) 2024 Nachtalb
+import numpy as np
+
+
+def normalize(grid: np.ndarray, max_value: int) -> np.ndarray:
+    """Normalize hit counts to intensities relative to the most hit cell.
+
+    Args:
+        grid (np.ndarray): 2D array of hit counts.
+        max_value (int): Highest hit count in the grid.
+
+    Returns:
+        np.ndarray: 2D uint8 array with 0 for no hits up to 255 for the most hit cell.
+    """
+    if max_value == 0:
+        return np.zeros_like(grid, dtype=np.uint8)
+    return (grid.astype(np.int64) * 255 // max_value).astype(np.uint8)
+
+
+def rasterize(grid: np.ndarray, out: np.ndarray, step: int, max_value: int) -> None:
+    """Render the heatmap colours of a grid into an RGB pixel buffer.
+
+    The colours are computed on the small grid and written to ``out`` in a single broadcast assignment, so no
+    image sized intermediate arrays are created. Cells are separated by black 1px grid lines.
+
+    Args:
+        grid (np.ndarray): 2D (size, size) array of hit counts.
+        out (np.ndarray): C-contiguous (size * step, size * step, 3) uint8 array to write the pixels to.
+        step (int): Width and height of a single cell in pixels.
+        max_value (int): Highest hit count in the grid.
+    """
+    size = grid.shape[0]
+    green_blue = normalize(grid, max_value)
+    np.subtract(255, green_blue, out=green_blue)  # White to Red gradient
+    cells = out.reshape(size, step, size, step, 3)
+    cells[..., 0] = 255
+    cells[..., 1] = cells[..., 2] = green_blue[:, np.newaxis, :, np.newaxis]
+
+    # Grid lines on the first pixel row and column of every cell but the first
+    if step:
+        out[step::step] = 0
+        out[:, step::step] = 0
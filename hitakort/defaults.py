@@ -7,6 +7,8 @@ CWD = Path().absolute()
 HIT_REGEX = re.compile(
     r"^(?P<letters>[a-zA-Z]+)(?P<numbers>\d+)$|^(?P<numbers_first>\d+)(?P<letters_second>[a-zA-Z]+)$"
 )
+MAX_IMAGE_SIZE = 1024  # Max width and height of the heatmap image in pixels
+
 TG_BASE_URL = "https://api.telegram.org/bot"
 
 TG_MAX_DOWNLOAD_SIZE = 20 * 1024 * 1024  # 20 MB
@@ -7,4 +7,4 @@ def sel(text: str) -> str:
     Returns:
         str: Stripped text
     """
-    return "\n".join(line.strip() for line in text.splitlines())
+    return "\n".join(map(str.strip, text.splitlines()))